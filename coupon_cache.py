@@ -0,0 +1,127 @@
+"""
+coupon_cache.py
+===============
+Process-local index of active coupons backing /applicable-coupons.
+
+The index is loaded from the database on first use and rebuilt lazily after
+any coupon mutation (the CRUD routes call `invalidate()` after committing).
+Coupons are bucketed by type so a cart only visits plausible candidates:
+cart-wise coupons are sorted by threshold and product-wise coupons are keyed
+by their target product.
+
+A short TTL bounds staleness when several worker processes share one database,
+since a write in one process cannot invalidate another process's copy.
+"""
+
+import threading
+import time
+from bisect import bisect_right
+from dataclasses import dataclass
+from datetime import datetime
+from operator import attrgetter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import models
+import coupon_engine
+from schemas import CouponType
+
+TTL_SECONDS = 5.0
+
+
+@dataclass(slots=True, frozen=True)
+class ParsedCoupon:
+    id: int
+    type: str
+    expiration_date: Optional[datetime]
+    parsed_details: coupon_engine.Rule
+
+
+@dataclass(slots=True, frozen=True)
+class ActiveIndex:
+    cart_wise: Tuple[ParsedCoupon, ...]              # ascending threshold
+    cart_wise_thresholds: Tuple[float, ...]
+    product_wise: Dict[int, Tuple[ParsedCoupon, ...]]  # product_id -> coupons
+    bxgy: Tuple[ParsedCoupon, ...]
+
+    def candidates(self, cart_total: float, product_ids: Iterable[int]) -> List[ParsedCoupon]:
+        """
+        Coupons that can possibly apply to a cart with this total and these
+        products, in id order. Only BxGy coupons are passed through unfiltered.
+        """
+        reachable = bisect_right(self.cart_wise_thresholds, cart_total)
+        found = list(self.cart_wise[:reachable])
+        for pid in product_ids:
+            found.extend(self.product_wise.get(pid, ()))
+        found.extend(self.bxgy)
+        found.sort(key=attrgetter("id"))
+        return found
+
+
+_lock = threading.Lock()
+_active: Optional[ActiveIndex] = None
+_loaded_at = 0.0
+
+
+def _build_index(coupons: List[ParsedCoupon]) -> ActiveIndex:
+    cart_wise = sorted(
+        (c for c in coupons if c.type == CouponType.cart_wise.value),
+        key=lambda c: c.parsed_details.threshold,
+    )
+    product_wise: Dict[int, List[ParsedCoupon]] = {}
+    for c in coupons:
+        if c.type == CouponType.product_wise.value:
+            product_wise.setdefault(c.parsed_details.product_id, []).append(c)
+    return ActiveIndex(
+        cart_wise=tuple(cart_wise),
+        cart_wise_thresholds=tuple(c.parsed_details.threshold for c in cart_wise),
+        product_wise={pid: tuple(cs) for pid, cs in product_wise.items()},
+        bxgy=tuple(c for c in coupons if c.type == CouponType.bxgy.value),
+    )
+
+
+def _load(db: Session) -> ActiveIndex:
+    # Plain column rows: no ORM instances or identity-map bookkeeping needed
+    rows = db.execute(
+        select(
+            models.Coupon.id,
+            models.Coupon.type,
+            models.Coupon.details,
+            models.Coupon.expiration_date,
+        ).where(models.Coupon.is_active == True)
+    ).all()
+
+    parsed = []
+    for cid, ctype, cdetails, cexp in rows:
+        try:
+            rule = coupon_engine.get_rule(cid, ctype, cdetails)
+        except Exception:
+            # Malformed coupon details — never applicable, skip silently
+            continue
+        parsed.append(ParsedCoupon(
+            id=cid,
+            type=ctype,
+            expiration_date=cexp,
+            parsed_details=rule,
+        ))
+    return _build_index(parsed)
+
+
+def get_active(db: Session) -> ActiveIndex:
+    """Returns the index of active coupons with pre-parsed details, loading it if needed."""
+    global _active, _loaded_at
+    with _lock:
+        now = time.monotonic()
+        if _active is None or now - _loaded_at > TTL_SECONDS:
+            _active = _load(db)
+            _loaded_at = now
+        return _active
+
+
+def invalidate() -> None:
+    """Drops the index; the next `get_active` call reloads it from the database."""
+    global _active
+    with _lock:
+        _active = None
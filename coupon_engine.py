@@ -31,32 +31,136 @@ Unimplemented / Noted Cases:
 """
 
 from datetime import datetime, timezone
-from typing import List, Tuple
-from schemas import CartItem, CartWiseDetails, ProductWiseDetails, BxGyDetails, BxGyProduct
+from operator import itemgetter
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+from schemas import CartItem, CartWiseDetails, ProductWiseDetails, BxGyDetails, CouponType
 
 
-def _cart_total(items: List[CartItem]) -> float:
-    return sum(item.price * item.quantity for item in items)
+# ─────────────────────────── Parsed Rules ───────────────────────────
+
+class CartWiseRule(NamedTuple):
+    threshold: float
+    discount: float
+
+
+class ProductWiseRule(NamedTuple):
+    product_id: int
+    discount: float
+
+
+class BxGyRule(NamedTuple):
+    buy_products_map: Dict[int, int]           # product_id -> quantity
+    buy_qty_needed: int                        # sum of buy quantities
+    get_products: Tuple[Tuple[int, int], ...]  # (product_id, quantity), unique ids
+    repition_limit: int
+
+
+Rule = Union[CartWiseRule, ProductWiseRule, BxGyRule]
+
+# Engine output for one cart line: (product_id, quantity, price, discount)
+CartLine = Tuple[int, int, float, float]
+
+# coupon_id -> (type, raw details, parsed rule)
+_rule_cache: Dict[int, Tuple[str, dict, Rule]] = {}
+
+
+def parse_details(coupon_type: str, details: dict) -> Rule:
+    """
+    Validates raw coupon details once and reduces them to a plain rule tuple,
+    so the discount functions never touch Pydantic on the hot path.
+    """
+    if coupon_type == CouponType.cart_wise.value:
+        d = CartWiseDetails(**details)
+        return CartWiseRule(d.threshold, d.discount)
+    if coupon_type == CouponType.product_wise.value:
+        d = ProductWiseDetails(**details)
+        return ProductWiseRule(d.product_id, d.discount)
+    if coupon_type == CouponType.bxgy.value:
+        d = BxGyDetails(**details)
+        buy_products_map: Dict[int, int] = {}
+        for bp in d.buy_products:
+            buy_products_map[bp.product_id] = buy_products_map.get(bp.product_id, 0) + bp.quantity
+        # Merge repeated get-products too (first-listed order kept), so each
+        # product_id appears once and free units can be assigned directly
+        get_products_map: Dict[int, int] = {}
+        for gp in d.get_products:
+            get_products_map[gp.product_id] = get_products_map.get(gp.product_id, 0) + gp.quantity
+        return BxGyRule(
+            buy_products_map=buy_products_map,
+            buy_qty_needed=sum(buy_products_map.values()),
+            get_products=tuple(get_products_map.items()),
+            repition_limit=d.repition_limit,
+        )
+    raise ValueError(f"Unknown coupon type: {coupon_type}")
+
+
+def get_rule(coupon_id: int, coupon_type: str, details: dict) -> Rule:
+    """
+    Returns the parsed rule for a coupon, re-parsing only when the stored
+    type/details differ from what was cached for this id.
+    """
+    cached = _rule_cache.get(coupon_id)
+    if cached is not None and cached[0] == coupon_type and cached[1] == details:
+        return cached[2]
+    rule = parse_details(coupon_type, details)
+    _rule_cache[coupon_id] = (coupon_type, details, rule)
+    return rule
+
+
+def invalidate_rule(coupon_id: int) -> None:
+    _rule_cache.pop(coupon_id, None)
+
+
+class _CartItem(NamedTuple):
+    """Internal cart line; far lighter to create and read than the Pydantic CartItem."""
+    product_id: int
+    quantity: int
+    price: float
+
+
+class CartView(NamedTuple):
+    """
+    A cart plus the figures every engine needs, computed once per request
+    and shared by all coupon evaluations against that cart.
+    """
+    items: List[_CartItem]
+    subtotals: List[float]         # price * quantity per line
+    total: float
+    by_pid: Dict[int, _CartItem]   # product_id -> item
+    subtotals_by_pid: Dict[int, List[float]]  # product_id -> line subtotals
+
+    @classmethod
+    def from_items(cls, cart_items: List[CartItem]) -> "CartView":
+        items = [_CartItem(i.product_id, i.quantity, i.price) for i in cart_items]
+        subtotals = [item.price * item.quantity for item in items]
+        by_pid = {item.product_id: item for item in items}
+        subtotals_by_pid: Dict[int, List[float]] = {}
+        for item, subtotal in zip(items, subtotals):
+            subtotals_by_pid.setdefault(item.product_id, []).append(subtotal)
+        return cls(items, subtotals, sum(subtotals), by_pid, subtotals_by_pid)
+
+
+def cart_lines(cart: CartView, per_item_discounts: List[float]) -> List[CartLine]:
+    """Pairs each cart item with its discount as a plain (product_id, quantity, price, discount) line."""
+    return [
+        (item.product_id, item.quantity, item.price, disc)
+        for item, disc in zip(cart.items, per_item_discounts)
+    ]
 
 
 # ─────────────────────────── Cart-wise ───────────────────────────
 
-def compute_cart_wise_discount(items: List[CartItem], details: dict) -> Tuple[float, List[float]]:
+def compute_cart_wise_discount(cart: CartView, d: CartWiseRule) -> Tuple[float, List[float]]:
     """
     Returns (total_discount, per_item_discounts list).
     Discount is split proportionally by item subtotal.
     """
-    d = CartWiseDetails(**details)
-    total = _cart_total(items)
+    total = cart.total
     if total < d.threshold:
-        return 0.0, [0.0] * len(items)
+        return 0.0, [0.0] * len(cart.items)
 
     total_discount = round(total * d.discount / 100, 2)
-    per_item = []
-    for item in items:
-        item_subtotal = item.price * item.quantity
-        share = round(item_subtotal / total * total_discount, 2)
-        per_item.append(share)
+    per_item = [round(sub / total * total_discount, 2) for sub in cart.subtotals]
 
     # Fix rounding drift on last item
     diff = round(total_discount - sum(per_item), 2)
@@ -68,118 +172,128 @@ def compute_cart_wise_discount(items: List[CartItem], details: dict) -> Tuple[fl
 
 # ─────────────────────────── Product-wise ───────────────────────────
 
-def compute_product_wise_discount(items: List[CartItem], details: dict) -> Tuple[float, List[float]]:
+def compute_product_wise_discount(cart: CartView, d: ProductWiseRule) -> Tuple[float, List[float]]:
     """
     Returns (total_discount, per_item_discounts list).
     Only the target product item gets a discount.
+    The total is the sum of the rounded line discounts, so the lines always
+    add up to it even when the product appears on several cart lines.
     """
-    d = ProductWiseDetails(**details)
-    per_item = []
-    total_discount = 0.0
+    per_item = [
+        round(subtotal * d.discount / 100, 2) if item.product_id == d.product_id else 0.0
+        for item, subtotal in zip(cart.items, cart.subtotals)
+    ]
+    return round(sum(per_item), 2), per_item
 
-    for item in items:
-        if item.product_id == d.product_id:
-            disc = round(item.price * item.quantity * d.discount / 100, 2)
-            per_item.append(disc)
-            total_discount += disc
-        else:
-            per_item.append(0.0)
 
-    return round(total_discount, 2), per_item
+def product_wise_total(cart: CartView, d: ProductWiseRule) -> float:
+    """
+    Total discount only, for callers that don't need the per-item breakdown.
+    A single dict lookup instead of a scan over the cart; rounds per line
+    exactly as `compute_product_wise_discount` does.
+    """
+    subtotals = cart.subtotals_by_pid.get(d.product_id, ())
+    return round(sum(round(subtotal * d.discount / 100, 2) for subtotal in subtotals), 2)
 
 
 # ─────────────────────────── BxGy ───────────────────────────
 
-def compute_bxgy_discount(items: List[CartItem], details: dict) -> Tuple[float, List[float], List[CartItem]]:
+def _bxgy_accumulate(
+    get_products_in_cart: List[Tuple[Tuple[int, int], float]], repetitions: int
+) -> Tuple[Dict[int, int], float]:
+    """
+    Grants `repetitions` rounds of free units in a single pass.
+    Every round hands out the same quantities, so the per-round loop collapses
+    to one multiplication per get-product. Products not in the cart carry
+    price 0.0 and therefore add no discount value.
+    Get-product ids are unique per rule, so each entry is assigned, not accumulated.
+    """
+    free_map: Dict[int, int] = {}  # product_id -> free_qty
+    total_discount = 0.0
+    for (gp_id, qty), price in get_products_in_cart:
+        free_qty = qty * repetitions
+        free_map[gp_id] = free_qty
+        total_discount += price * free_qty
+    return free_map, total_discount
+
+
+def compute_bxgy_discount(cart: CartView, d: BxGyRule) -> Tuple[float, List[CartLine]]:
     """
-    Returns (total_discount, per_item_discounts, updated_items_with_free_products).
+    Returns (total_discount, updated cart lines including free products).
 
     Algorithm:
     1. Count how many qualifying "buy" products are in the cart (by product_id).
     2. Determine how many repetitions are earned (capped by repition_limit).
-    3. For each repetition, grant free_qty units from "get_products" whose products
-       are already in the cart (or add them if missing).
+    3. Grant repetitions * quantity free units of each "get_products" entry,
+       whether already in the cart or added as missing.
     4. Free units are given to the cheapest "get" products first.
     """
-    d = BxGyDetails(**details)
-
-    # Build a lookup for items already in cart
-    cart_map = {item.product_id: item for item in items}
+    items = cart.items
+    cart_map = cart.by_pid
 
     # ── Step 1: count qualifying buy-product units ──
-    total_buy_units = 0
-    buy_qty_needed = sum(bp.quantity for bp in d.buy_products)
-
-    for bp in d.buy_products:
-        if bp.product_id in cart_map:
-            total_buy_units += cart_map[bp.product_id].quantity
+    # Probe whichever side is smaller against the other's dict
+    buy_map = d.buy_products_map
+    buy_qty_needed = d.buy_qty_needed
+    if len(buy_map) <= len(cart_map):
+        total_buy_units = sum(cart_map[pid].quantity for pid in buy_map if pid in cart_map)
+    else:
+        total_buy_units = sum(item.quantity for pid, item in cart_map.items() if pid in buy_map)
 
     if buy_qty_needed == 0:
-        return 0.0, [0.0] * len(items), list(items)
+        return 0.0, cart_lines(cart, [0.0] * len(items))
 
     repetitions = total_buy_units // buy_qty_needed
     repetitions = min(repetitions, d.repition_limit)
 
     if repetitions == 0:
-        return 0.0, [0.0] * len(items), list(items)
+        return 0.0, cart_lines(cart, [0.0] * len(items))
 
     # ── Step 2: determine free units from "get" list ──
-    # Sort by ascending unit price (cheapest first)
+    # Sort only the get-products present in the cart by ascending unit price
+    # (cheapest first). Missing products have no known price; they go last,
+    # in coupon order, and are added to the cart as free lines.
     get_products_in_cart = []
+    missing = []
     for gp in d.get_products:
-        if gp.product_id in cart_map:
-            get_products_in_cart.append((gp, cart_map[gp.product_id].price))
+        item = cart_map.get(gp[0])
+        if item is not None:
+            get_products_in_cart.append((gp, item.price))
         else:
-            # Product not in cart — will be added as free
-            get_products_in_cart.append((gp, 0.0))  # price unknown, treat as 0
+            missing.append((gp, 0.0))
 
-    get_products_in_cart.sort(key=lambda x: x[1])
+    get_products_in_cart.sort(key=itemgetter(1))
+    get_products_in_cart.extend(missing)
 
-    total_discount = 0.0
-    free_map: dict[int, int] = {}  # product_id -> free_qty
-
-    for _ in range(repetitions):
-        for gp, price in get_products_in_cart:
-            free_qty = gp.quantity
-            free_map[gp.product_id] = free_map.get(gp.product_id, 0) + free_qty
-            if gp.product_id in cart_map:
-                discount_val = cart_map[gp.product_id].price * free_qty
-            else:
-                # Not in cart, no discount value calculable
-                discount_val = 0.0
-            total_discount += discount_val
-
-    # ── Step 3: build updated items list ──
-    updated_items = []
-    per_item_discounts = []
-
-    for item in items:
+    free_map, total_discount = _bxgy_accumulate(get_products_in_cart, repetitions)
+
+    # ── Step 3: build updated cart lines ──
+    # Start from the unchanged cart; only lines that gained free units are rewritten
+    lines = cart_lines(cart, [0.0] * len(items))
+
+    for i, item in enumerate(items):
         free_qty = free_map.pop(item.product_id, 0)
-        if free_qty > 0:
+        if free_qty:
             disc = round(item.price * free_qty, 2)
-            per_item_discounts.append(disc)
-            updated_items.append(CartItem(
-                product_id=item.product_id,
-                quantity=item.quantity + free_qty,
-                price=item.price
-            ))
-        else:
-            per_item_discounts.append(0.0)
-            updated_items.append(item)
+            lines[i] = (item.product_id, item.quantity + free_qty, item.price, disc)
 
     # Add get_products not already in cart
-    for pid, qty in free_map.items():
-        per_item_discounts.append(0.0)
-        updated_items.append(CartItem(product_id=pid, quantity=qty, price=0.0))
+    lines.extend((pid, qty, 0.0, 0.0) for pid, qty in free_map.items())
 
-    return round(total_discount, 2), per_item_discounts, updated_items
+    return round(total_discount, 2), lines
 
 
 # ─────────────────────────── Expiry Check ───────────────────────────
 
-def is_coupon_expired(expiration_date) -> bool:
+def is_coupon_expired(
+    expiration_date, now: Optional[datetime] = None, now_utc: Optional[datetime] = None
+) -> bool:
+    """
+    `now` (naive local) and `now_utc` (aware) let a caller checking many coupons
+    read the clock once per request; each is only looked up when missing.
+    """
     if expiration_date is None:
         return False
     if expiration_date.tzinfo is None:
-        return expiration_date < datetime.now()
-    return expiration_date < datetime.now(timezone.utc)
+        return expiration_date < (now if now is not None else datetime.now())
+    return expiration_date < (now_utc if now_utc is not None else datetime.now(timezone.utc))
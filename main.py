@@ -13,14 +13,17 @@ Endpoints:
   POST   /apply-coupon/{id}     - Apply a specific coupon to the cart
 """
 
+from datetime import datetime, timezone
+
 from fastapi import FastAPI, HTTPException, Depends, status
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.orm import Session
 from typing import List
 
 import models
 import schemas
 import coupon_engine
+import coupon_cache
 from database import engine, get_db
 
 # Create DB tables on startup
@@ -30,6 +33,7 @@ app = FastAPI(
     title="Coupons Management API",
     description="RESTful API to manage cart-wise, product-wise, and BxGy discount coupons for an e-commerce platform.",
     version="1.0.0",
+    default_response_class=ORJSONResponse,
 )
 
 
@@ -59,6 +63,9 @@ def create_coupon(coupon: schemas.CouponCreate, db: Session = Depends(get_db)):
     db.add(db_coupon)
     db.commit()
     db.refresh(db_coupon)
+    # Warm the parsed-rule cache so the first cart evaluation skips validation
+    coupon_engine.get_rule(db_coupon.id, db_coupon.type, db_coupon.details)
+    coupon_cache.invalidate()
     return db_coupon
 
 
@@ -112,6 +119,8 @@ def update_coupon(coupon_id: int, update_data: schemas.CouponUpdate, db: Session
 
     db.commit()
     db.refresh(coupon)
+    coupon_engine.invalidate_rule(coupon_id)
+    coupon_cache.invalidate()
     return coupon
 
 
@@ -128,6 +137,8 @@ def delete_coupon(coupon_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail=f"Coupon with id={coupon_id} not found")
     db.delete(coupon)
     db.commit()
+    coupon_engine.invalidate_rule(coupon_id)
+    coupon_cache.invalidate()
     return None
 
 
@@ -147,38 +158,41 @@ def get_applicable_coupons(request: schemas.CartRequest, db: Session = Depends(g
     returns all currently applicable and non-expired coupons along with
     the computed discount each would provide.
     """
-    items = request.cart.items
-    all_coupons = db.query(models.Coupon).filter(models.Coupon.is_active == True).all()
+    cart = coupon_engine.CartView.from_items(request.cart.items)
+    now, now_utc = datetime.now(), datetime.now(timezone.utc)
 
     applicable = []
-    for coupon in all_coupons:
+    candidates = coupon_cache.get_active(db).candidates(cart.total, cart.by_pid)
+    for coupon in candidates:
         # Skip expired coupons
-        if coupon_engine.is_coupon_expired(coupon.expiration_date):
+        if coupon_engine.is_coupon_expired(coupon.expiration_date, now, now_utc):
             continue
 
         discount = 0.0
+        rule = coupon.parsed_details
         try:
             if coupon.type == schemas.CouponType.cart_wise.value:
-                discount, _ = coupon_engine.compute_cart_wise_discount(items, coupon.details)
+                discount, _ = coupon_engine.compute_cart_wise_discount(cart, rule)
 
             elif coupon.type == schemas.CouponType.product_wise.value:
-                discount, _ = coupon_engine.compute_product_wise_discount(items, coupon.details)
+                discount = coupon_engine.product_wise_total(cart, rule)
 
             elif coupon.type == schemas.CouponType.bxgy.value:
-                discount, _, _ = coupon_engine.compute_bxgy_discount(items, coupon.details)
+                discount, _ = coupon_engine.compute_bxgy_discount(cart, rule)
 
         except Exception:
-            # Malformed coupon details — skip silently
+            # Coupon cannot be evaluated against this cart — skip silently
             continue
 
         if discount > 0:
-            applicable.append(schemas.ApplicableCoupon(
+            applicable.append(schemas.ApplicableCoupon.model_construct(
                 coupon_id=coupon.id,
-                type=coupon.type,
+                type=schemas.CouponType(coupon.type),
                 discount=discount,
             ))
 
-    return schemas.ApplicableCouponsResponse(applicable_coupons=applicable)
+    # Server-built response — no need to re-run validators
+    return schemas.ApplicableCouponsResponse.model_construct(applicable_coupons=applicable)
 
 
 # ═══════════════════════════════════════════════════
@@ -211,29 +225,26 @@ def apply_coupon(coupon_id: int, request: schemas.CartRequest, db: Session = Dep
     if coupon_engine.is_coupon_expired(coupon.expiration_date):
         raise HTTPException(status_code=400, detail="Coupon has expired")
 
-    items = request.cart.items
-    per_item_discounts = [0.0] * len(items)
-    total_discount = 0.0
-    final_items = list(items)
+    cart = coupon_engine.CartView.from_items(request.cart.items)
+
+    if coupon.type not in {t.value for t in schemas.CouponType}:
+        raise HTTPException(status_code=400, detail=f"Unknown coupon type: {coupon.type}")
 
     try:
+        rule = coupon_engine.get_rule(coupon.id, coupon.type, coupon.details)
+
         if coupon.type == schemas.CouponType.cart_wise.value:
-            total_discount, per_item_discounts = coupon_engine.compute_cart_wise_discount(items, coupon.details)
+            total_discount, per_item_discounts = coupon_engine.compute_cart_wise_discount(cart, rule)
+            lines = coupon_engine.cart_lines(cart, per_item_discounts)
 
         elif coupon.type == schemas.CouponType.product_wise.value:
-            total_discount, per_item_discounts = coupon_engine.compute_product_wise_discount(items, coupon.details)
-
-        elif coupon.type == schemas.CouponType.bxgy.value:
-            total_discount, per_item_discounts, final_items = coupon_engine.compute_bxgy_discount(items, coupon.details)
-            # Pad discounts if new items were added
-            while len(per_item_discounts) < len(final_items):
-                per_item_discounts.append(0.0)
+            total_discount, per_item_discounts = coupon_engine.compute_product_wise_discount(cart, rule)
+            lines = coupon_engine.cart_lines(cart, per_item_discounts)
 
         else:
-            raise HTTPException(status_code=400, detail=f"Unknown coupon type: {coupon.type}")
+            # BxGy may add free products to the cart
+            total_discount, lines = coupon_engine.compute_bxgy_discount(cart, rule)
 
-    except HTTPException:
-        raise
     except Exception as e:
         raise HTTPException(status_code=422, detail=f"Could not apply coupon: {str(e)}")
 
@@ -244,24 +255,25 @@ def apply_coupon(coupon_id: int, request: schemas.CartRequest, db: Session = Dep
         )
 
     # Build response items
-    total_price = sum(item.price * item.quantity for item in items)  # original cart total
+    total_price = cart.total  # original cart total
     final_price = round(total_price - total_discount, 2)
 
-    updated_items = []
-    for i, item in enumerate(final_items):
-        disc = per_item_discounts[i] if i < len(per_item_discounts) else 0.0
-        updated_items.append(schemas.UpdatedCartItem(
-            product_id=item.product_id,
-            quantity=item.quantity,
-            price=item.price,
-            total_discount=round(disc, 2),
-        ))
-
-    return schemas.ApplyCouponResponse(
-        updated_cart=schemas.UpdatedCart(
+    # Engine output is trusted and already rounded, so response models skip validation
+    updated_items = [
+        schemas.UpdatedCartItem.model_construct(
+            product_id=pid,
+            quantity=qty,
+            price=price,
+            total_discount=disc,
+        )
+        for pid, qty, price, disc in lines
+    ]
+
+    return schemas.ApplyCouponResponse.model_construct(
+        updated_cart=schemas.UpdatedCart.model_construct(
             items=updated_items,
             total_price=round(total_price, 2),
-            total_discount=round(total_discount, 2),
+            total_discount=total_discount,
             final_price=final_price,
         )
     )
@@ -1,4 +1,5 @@
-from pydantic import BaseModel, field_validator, model_validator
+from pydantic import BaseModel, ValidationError, field_validator, model_validator
+from pydantic_core import InitErrorDetails
 from typing import Optional, List, Any
 from datetime import datetime
 from enum import Enum
@@ -119,29 +120,34 @@ class CouponResponse(BaseModel):
 
 # ─────────────── Cart schemas ───────────────
 
+def _value_error(loc: tuple, value: Any, message: str) -> InitErrorDetails:
+    """A value_error entry shaped like the one a field validator would raise."""
+    return {"type": "value_error", "loc": loc, "input": value, "ctx": {"error": ValueError(message)}}
+
+
 class CartItem(BaseModel):
     product_id: int
     quantity: int
     price: float  # Price per unit
 
-    @field_validator("quantity")
-    @classmethod
-    def qty_positive(cls, v: int) -> int:
-        if v <= 0:
-            raise ValueError("Quantity must be positive")
-        return v
-
-    @field_validator("price")
-    @classmethod
-    def price_positive(cls, v: float) -> float:
-        if v <= 0:
-            raise ValueError("Price must be positive")
-        return v
-
 
 class Cart(BaseModel):
     items: List[CartItem]
 
+    @model_validator(mode="after")
+    def items_positive(self) -> "Cart":
+        # One pass over the cart instead of two field validators per item.
+        # Every violation is reported at its own item/field location.
+        errors = []
+        for i, item in enumerate(self.items):
+            if item.quantity <= 0:
+                errors.append(_value_error(("items", i, "quantity"), item.quantity, "Quantity must be positive"))
+            if item.price <= 0:
+                errors.append(_value_error(("items", i, "price"), item.price, "Price must be positive"))
+        if errors:
+            raise ValidationError.from_exception_data("Cart", errors)
+        return self
+
 
 class CartRequest(BaseModel):
     cart: Cart
@@ -11,76 +11,179 @@ Covers:
 - Error cases: coupon not found, conditions not met, expired coupon
 """
 
+import functools
+from datetime import datetime
+
+import orjson
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 
+import coupon_cache
 import models
 from database import Base
 from main import app, get_db
 
 # ── In-memory SQLite for tests ──
-TEST_DATABASE_URL = "sqlite:///./test_coupons.db"
+# StaticPool hands every session the same single connection, so all of them
+# see the one in-memory database. Under pytest-xdist each worker is its own
+# process and therefore gets its own private database.
+TEST_DATABASE_URL = "sqlite://"
+
+test_engine = create_engine(
+    TEST_DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    poolclass=StaticPool,
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False)
+
+
+# pysqlite's own transaction handling breaks SAVEPOINT; let SQLAlchemy emit BEGIN
+@event.listens_for(test_engine, "connect")
+def _disable_pysqlite_begin(dbapi_conn, _):
+    dbapi_conn.isolation_level = None
+
 
-test_engine = create_engine(TEST_DATABASE_URL, connect_args={"check_same_thread": False})
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=test_engine)
+# Durability is irrelevant for a throwaway test database
+@event.listens_for(test_engine, "connect")
+def _fast_sqlite(dbapi_conn, _):
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA synchronous=OFF")
+    cur.execute("PRAGMA journal_mode=MEMORY")
+    cur.execute("PRAGMA temp_store=MEMORY")
+    cur.close()
+
+
+@event.listens_for(test_engine, "begin")
+def _emit_begin(conn):
+    conn.exec_driver_sql("BEGIN")
 
 
 def override_get_db():
-    db = TestingSessionLocal()
-    try:
+    with TestingSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
-@pytest.fixture(autouse=True)
-def setup_db():
-    """Create fresh tables before each test and drop them after."""
+# Identical for every test, so installed once for the whole module
+app.dependency_overrides[get_db] = override_get_db
+
+
+@pytest.fixture(scope="session")
+def _schema():
+    """Create the tables once for the whole run."""
     Base.metadata.create_all(bind=test_engine)
-    app.dependency_overrides[get_db] = override_get_db
     yield
     Base.metadata.drop_all(bind=test_engine)
-    app.dependency_overrides.clear()
 
 
-client = TestClient(app)
+@pytest.fixture(autouse=True)
+def setup_db(_schema):
+    """
+    Run each test inside an outer transaction that is rolled back afterwards.
+    Sessions join it through a SAVEPOINT, so endpoint commits stay invisible
+    to the next test.
+    """
+    connection = test_engine.connect()
+    transaction = connection.begin()
+    TestingSessionLocal.configure(bind=connection, join_transaction_mode="create_savepoint")
+    coupon_cache.invalidate()
+    yield
+    transaction.rollback()
+    connection.close()
+
+
+JSON_HEADERS = {"content-type": "application/json"}
+
+
+@pytest.fixture(scope="session")
+def client():
+    """
+    One TestClient for the whole run; the app lifespan stays open throughout.
+    Bodies are sent pre-encoded, so the JSON content type is a client default.
+    """
+    with TestClient(app, headers=JSON_HEADERS) as c:
+        yield c
 
 
 # ══════════════════════════════════════════════
 #  Helper functions
 # ══════════════════════════════════════════════
 
-def create_cart_wise_coupon(threshold=100, discount=10):
-    return client.post("/coupons", json={
+@functools.lru_cache(maxsize=None)
+def _cart_wise_body(threshold, discount):
+    return orjson.dumps({
         "type": "cart-wise",
         "details": {"threshold": threshold, "discount": discount}
     })
 
 
-def create_product_wise_coupon(product_id=1, discount=20):
-    return client.post("/coupons", json={
+@functools.lru_cache(maxsize=None)
+def _product_wise_body(product_id, discount):
+    return orjson.dumps({
         "type": "product-wise",
         "details": {"product_id": product_id, "discount": discount}
     })
 
 
-def create_bxgy_coupon(buy_products=None, get_products=None, repition_limit=2):
-    if buy_products is None:
-        buy_products = [{"product_id": 1, "quantity": 3}, {"product_id": 2, "quantity": 3}]
-    if get_products is None:
-        get_products = [{"product_id": 3, "quantity": 1}]
-    return client.post("/coupons", json={
+def create_cart_wise_coupon(client, threshold=100, discount=10):
+    return client.post("/coupons", content=_cart_wise_body(threshold, discount))
+
+
+def create_product_wise_coupon(client, product_id=1, discount=20):
+    return client.post("/coupons", content=_product_wise_body(product_id, discount))
+
+
+# (product_id, quantity) pairs — hashable, so the encoded body can be cached
+_DEFAULT_BUY = ((1, 3), (2, 3))
+_DEFAULT_GET = ((3, 1),)
+
+
+@functools.lru_cache(maxsize=None)
+def _bxgy_body(buy_products, get_products, repition_limit):
+    return orjson.dumps({
         "type": "bxgy",
         "details": {
-            "buy_products": buy_products,
-            "get_products": get_products,
+            "buy_products": [{"product_id": p, "quantity": q} for p, q in buy_products],
+            "get_products": [{"product_id": p, "quantity": q} for p, q in get_products],
             "repition_limit": repition_limit
         }
     })
 
 
+def create_bxgy_coupon(client, buy_products=_DEFAULT_BUY, get_products=_DEFAULT_GET, repition_limit=2):
+    return client.post("/coupons", content=_bxgy_body(buy_products, get_products, repition_limit))
+
+
+def seed_many(coupons):
+    """
+    Insert several coupon rows (dicts of Coupon columns) in one transaction,
+    bypassing the API, and return their ids in order.
+    """
+    with TestingSessionLocal() as s:
+        rows = [models.Coupon(**c) for c in coupons]
+        s.add_all(rows)
+        s.commit()
+        ids = [row.id for row in rows]
+    # Written outside the API, so the active-coupon index must be dropped by hand
+    coupon_cache.invalidate()
+    return ids
+
+
+def seed_coupon(type_, details, is_active=True, expiration_date=None):
+    """
+    Insert a single coupon row directly and return its id.
+    For tests whose subject is applying coupons rather than creating them.
+    """
+    return seed_many([{
+        "type": type_,
+        "details": details,
+        "is_active": is_active,
+        "expiration_date": expiration_date,
+    }])[0]
+
+
 SAMPLE_CART = {
     "cart": {
         "items": [
@@ -92,300 +195,406 @@ SAMPLE_CART = {
 }
 
 
+# Encoded once; sent as the raw request body instead of re-serializing per call
+SAMPLE_CART_BYTES = orjson.dumps(SAMPLE_CART)
+
+
+def _by_pid(cart):
+    """Index a response cart's items by product_id."""
+    return {i["product_id"]: i for i in cart["items"]}
+
+
 # ══════════════════════════════════════════════
 #  CRUD Tests
 # ══════════════════════════════════════════════
 
-class TestCouponCRUD:
-
-    def test_create_cart_wise_coupon(self):
-        resp = create_cart_wise_coupon()
-        assert resp.status_code == 201
-        body = resp.json()
-        assert body["type"] == "cart-wise"
-        assert body["details"]["threshold"] == 100
-        assert body["details"]["discount"] == 10
-        assert body["is_active"] is True
-        assert "id" in body
-
-    def test_create_product_wise_coupon(self):
-        resp = create_product_wise_coupon()
-        assert resp.status_code == 201
-        body = resp.json()
-        assert body["type"] == "product-wise"
-        assert body["details"]["product_id"] == 1
-
-    def test_create_bxgy_coupon(self):
-        resp = create_bxgy_coupon()
-        assert resp.status_code == 201
-        body = resp.json()
-        assert body["type"] == "bxgy"
-        assert body["details"]["repition_limit"] == 2
-
-    def test_get_all_coupons(self):
-        create_cart_wise_coupon()
-        create_product_wise_coupon()
-        resp = client.get("/coupons")
-        assert resp.status_code == 200
-        assert len(resp.json()) == 2
-
-    def test_get_coupon_by_id(self):
-        created = create_cart_wise_coupon().json()
-        resp = client.get(f"/coupons/{created['id']}")
-        assert resp.status_code == 200
-        assert resp.json()["id"] == created["id"]
-
-    def test_get_coupon_not_found(self):
-        resp = client.get("/coupons/9999")
-        assert resp.status_code == 404
-
-    def test_update_coupon(self):
-        created = create_cart_wise_coupon().json()
-        resp = client.put(f"/coupons/{created['id']}", json={"is_active": False})
-        assert resp.status_code == 200
-        assert resp.json()["is_active"] is False
-
-    def test_delete_coupon(self):
-        created = create_cart_wise_coupon().json()
-        resp = client.delete(f"/coupons/{created['id']}")
-        assert resp.status_code == 204
-        resp = client.get(f"/coupons/{created['id']}")
-        assert resp.status_code == 404
-
-    def test_delete_coupon_not_found(self):
-        resp = client.delete("/coupons/9999")
-        assert resp.status_code == 404
+def test_create_cart_wise_coupon(client):
+    resp = create_cart_wise_coupon(client)
+    assert resp.status_code == 201
+    body = resp.json()
+    assert body["type"] == "cart-wise"
+    assert body["details"]["threshold"] == 100
+    assert body["details"]["discount"] == 10
+    assert body["is_active"] is True
+    assert "id" in body
+
+
+def test_create_product_wise_coupon(client):
+    resp = create_product_wise_coupon(client)
+    assert resp.status_code == 201
+    body = resp.json()
+    assert body["type"] == "product-wise"
+    assert body["details"]["product_id"] == 1
+
+
+def test_create_bxgy_coupon(client):
+    resp = create_bxgy_coupon(client)
+    assert resp.status_code == 201
+    body = resp.json()
+    assert body["type"] == "bxgy"
+    assert body["details"]["repition_limit"] == 2
+
+
+def test_get_all_coupons(client):
+    seed_many([
+        {"type": "cart-wise", "details": {"threshold": 100, "discount": 10}},
+        {"type": "product-wise", "details": {"product_id": 1, "discount": 20}},
+    ])
+    resp = client.get("/coupons")
+    assert resp.status_code == 200
+    assert len(resp.json()) == 2
+
+
+def test_get_coupon_by_id(client):
+    created = create_cart_wise_coupon(client).json()
+    resp = client.get(f"/coupons/{created['id']}")
+    assert resp.status_code == 200
+    assert resp.json()["id"] == created["id"]
+
+
+@pytest.mark.parametrize("method,url,body", [
+    ("GET", "/coupons/9999", None),
+    ("PUT", "/coupons/9999", b'{"is_active": false}'),
+    ("DELETE", "/coupons/9999", None),
+    ("POST", "/apply-coupon/9999", SAMPLE_CART_BYTES),
+])
+def test_missing_coupon(client, method, url, body):
+    resp = client.request(method, url, content=body)
+    assert resp.status_code == 404
+
+
+def test_update_coupon(client):
+    created = create_cart_wise_coupon(client).json()
+    resp = client.put(f"/coupons/{created['id']}", json={"is_active": False})
+    assert resp.status_code == 200
+    assert resp.json()["is_active"] is False
+    with TestingSessionLocal() as s:
+        assert s.get(models.Coupon, created["id"]).is_active is False
+
+
+def test_delete_coupon(client):
+    created = create_cart_wise_coupon(client).json()
+    resp = client.delete(f"/coupons/{created['id']}")
+    assert resp.status_code == 204
+    with TestingSessionLocal() as s:
+        assert s.get(models.Coupon, created["id"]) is None
 
 
 # ══════════════════════════════════════════════
 #  Validation Tests
 # ══════════════════════════════════════════════
 
-class TestValidation:
-
-    def test_invalid_coupon_type(self):
-        resp = client.post("/coupons", json={
-            "type": "super-sale",
-            "details": {}
-        })
-        assert resp.status_code == 422
-
-    def test_cart_wise_negative_threshold(self):
-        resp = client.post("/coupons", json={
-            "type": "cart-wise",
-            "details": {"threshold": -50, "discount": 10}
-        })
-        assert resp.status_code == 422
-
-    def test_product_wise_discount_over_100(self):
-        resp = client.post("/coupons", json={
-            "type": "product-wise",
-            "details": {"product_id": 1, "discount": 110}
-        })
-        assert resp.status_code == 422
-
-    def test_bxgy_empty_buy_products(self):
-        resp = client.post("/coupons", json={
-            "type": "bxgy",
-            "details": {
-                "buy_products": [],
-                "get_products": [{"product_id": 3, "quantity": 1}],
-                "repition_limit": 1
-            }
-        })
-        assert resp.status_code == 422
+@pytest.mark.parametrize("body", [
+    pytest.param({"type": "super-sale", "details": {}}, id="invalid-type"),
+    pytest.param(
+        {"type": "cart-wise", "details": {"threshold": -50, "discount": 10}},
+        id="cart-wise-negative-threshold",
+    ),
+    pytest.param(
+        {"type": "product-wise", "details": {"product_id": 1, "discount": 110}},
+        id="product-wise-discount-over-100",
+    ),
+    pytest.param(
+        {"type": "bxgy", "details": {
+            "buy_products": [],
+            "get_products": [{"product_id": 3, "quantity": 1}],
+            "repition_limit": 1
+        }},
+        id="bxgy-empty-buy-products",
+    ),
+])
+def test_validation_rejects(client, body):
+    resp = client.post("/coupons", json=body)
+    assert resp.status_code == 422
+
+
+def test_cart_non_positive_quantity(client):
+    resp = client.post("/applicable-coupons", json={
+        "cart": {"items": [{"product_id": 1, "quantity": 0, "price": 50}]}
+    })
+    assert resp.status_code == 422
+    assert "Quantity must be positive" in resp.text
+
+
+def test_cart_non_positive_price(client):
+    resp = client.post("/applicable-coupons", json={
+        "cart": {"items": [{"product_id": 1, "quantity": 1, "price": -5}]}
+    })
+    assert resp.status_code == 422
+    assert "Price must be positive" in resp.text
+
+
+def test_cart_errors_located_per_item(client):
+    """Every bad field is reported at its own item index, not once for the whole cart"""
+    resp = client.post("/applicable-coupons", json={"cart": {"items": [
+        {"product_id": 1, "quantity": 2, "price": 10},
+        {"product_id": 2, "quantity": 0, "price": -1},
+        {"product_id": 3, "quantity": -1, "price": 5},
+    ]}})
+    assert resp.status_code == 422
+    errors = [(e["loc"], e["input"]) for e in resp.json()["detail"]]
+    assert errors == [
+        (["body", "cart", "items", 1, "quantity"], 0),
+        (["body", "cart", "items", 1, "price"], -1),
+        (["body", "cart", "items", 2, "quantity"], -1),
+    ]
+
+
+# ══════════════════════════════════════════════
+#  Applicable + Apply: one case per coupon type
+# ══════════════════════════════════════════════
+
+# SAMPLE_CART total = 6*50 + 3*30 + 2*25 = 300+90+50 = 440.
+# Each case: (type, details, total discount, expected (product_id, quantity, discount) lines)
+DISCOUNT_CASES = [
+    pytest.param(
+        "cart-wise", {"threshold": 100, "discount": 10},
+        44.0,  # 10% of 440, split by subtotal
+        [(1, 6, 30.0), (2, 3, 9.0), (3, 2, 5.0)],
+        id="cart-wise",
+    ),
+    pytest.param(
+        "product-wise", {"product_id": 1, "discount": 20},
+        60.0,  # 20% of 6*50=300, only product 1 is discounted
+        [(1, 6, 60.0), (2, 3, 0.0), (3, 2, 0.0)],
+        id="product-wise",
+    ),
+    pytest.param(
+        # buy_qty_needed = 3+3 = 6, buy units = 6+3 = 9 => 1 repetition (limit 2)
+        # => 1 free unit of P3 (price=25), quantity 2 + 1 = 3
+        "bxgy", {
+            "buy_products": [{"product_id": 1, "quantity": 3}, {"product_id": 2, "quantity": 3}],
+            "get_products": [{"product_id": 3, "quantity": 1}],
+            "repition_limit": 2
+        },
+        25.0,
+        [(1, 6, 0.0), (2, 3, 0.0), (3, 3, 25.0)],
+        id="bxgy",
+    ),
+]
+
+
+@pytest.mark.parametrize("coupon_type,details,expected_discount,expected_lines", DISCOUNT_CASES)
+def test_applicable_and_apply(client, coupon_type, details, expected_discount, expected_lines):
+    """Both endpoints agree on the discount for the same seeded coupon"""
+    coupon_id = seed_coupon(coupon_type, details)
+
+    resp = client.post("/applicable-coupons", content=SAMPLE_CART_BYTES)
+    assert resp.status_code == 200
+    assert resp.json()["applicable_coupons"] == [
+        {"coupon_id": coupon_id, "type": coupon_type, "discount": expected_discount}
+    ]
+
+    resp = client.post(f"/apply-coupon/{coupon_id}", content=SAMPLE_CART_BYTES)
+    assert resp.status_code == 200
+    cart = resp.json()["updated_cart"]
+    assert cart["total_price"] == 440.0
+    assert cart["total_discount"] == expected_discount
+    assert cart["final_price"] == 440.0 - expected_discount
+    lines = [(i["product_id"], i["quantity"], i["total_discount"]) for i in cart["items"]]
+    assert lines == expected_lines
 
 
 # ══════════════════════════════════════════════
 #  Applicable Coupons Tests
 # ══════════════════════════════════════════════
 
-class TestApplicableCoupons:
-
-    def test_cart_wise_applicable(self):
-        """Cart total = 6*50 + 3*30 + 2*25 = 300+90+50 = 440 > 100, so applicable"""
-        create_cart_wise_coupon(threshold=100, discount=10)
-        resp = client.post("/applicable-coupons", json=SAMPLE_CART)
-        assert resp.status_code == 200
-        coupons = resp.json()["applicable_coupons"]
-        assert len(coupons) == 1
-        assert coupons[0]["type"] == "cart-wise"
-        assert coupons[0]["discount"] == 44.0  # 10% of 440
-
-    def test_cart_wise_not_applicable_below_threshold(self):
-        """Cart total 440 >= threshold 500, so NOT applicable"""
-        create_cart_wise_coupon(threshold=500, discount=10)
-        resp = client.post("/applicable-coupons", json=SAMPLE_CART)
-        assert resp.status_code == 200
-        assert resp.json()["applicable_coupons"] == []
-
-    def test_product_wise_applicable(self):
-        """Product 1 is in the cart with quantity 6 at price 50"""
-        create_product_wise_coupon(product_id=1, discount=20)
-        resp = client.post("/applicable-coupons", json=SAMPLE_CART)
-        assert resp.status_code == 200
-        coupons = resp.json()["applicable_coupons"]
-        assert len(coupons) == 1
-        assert coupons[0]["discount"] == 60.0  # 20% of 6*50=300
-
-    def test_product_wise_not_applicable(self):
-        """Product 99 is not in the cart"""
-        create_product_wise_coupon(product_id=99, discount=20)
-        resp = client.post("/applicable-coupons", json=SAMPLE_CART)
-        assert resp.json()["applicable_coupons"] == []
-
-    def test_bxgy_applicable(self):
-        """
-        Buy 3 of P1 or P2. Cart has 6 of P1 and 3 of P2.
-        buy_qty_needed = 3+3 = 6. total buy units = 6+3 = 9. repetitions = 9 // 6 = 1 (but limit=2).
-        Actually with buy_products=[{p1,q3},{p2,q3}], buy_qty_needed = 3+3 = 6.
-        total buy units from p1=6, p2=3 => 9. repetitions = 9//6 = 1, capped at 2.
-        So 1 repetition => 1 free unit of p3 (price=25). discount=25.
-        """
-        create_bxgy_coupon(
-            buy_products=[{"product_id": 1, "quantity": 3}, {"product_id": 2, "quantity": 3}],
-            get_products=[{"product_id": 3, "quantity": 1}],
-            repition_limit=2
-        )
-        resp = client.post("/applicable-coupons", json=SAMPLE_CART)
-        assert resp.status_code == 200
-        coupons = resp.json()["applicable_coupons"]
-        assert len(coupons) == 1
-        assert coupons[0]["type"] == "bxgy"
-        assert coupons[0]["discount"] == 25.0
-
-    def test_inactive_coupon_excluded(self):
-        """Inactive coupons should not appear in applicable-coupons"""
-        created = create_cart_wise_coupon().json()
-        client.put(f"/coupons/{created['id']}", json={"is_active": False})
-        resp = client.post("/applicable-coupons", json=SAMPLE_CART)
-        assert resp.json()["applicable_coupons"] == []
+def test_cart_wise_not_applicable_below_threshold(client):
+    """Cart total 440 >= threshold 500, so NOT applicable"""
+    seed_coupon("cart-wise", {"threshold": 500, "discount": 10})
+    resp = client.post("/applicable-coupons", content=SAMPLE_CART_BYTES)
+    assert resp.status_code == 200
+    assert resp.json()["applicable_coupons"] == []
+
+
+def test_product_wise_not_applicable(client):
+    """Product 99 is not in the cart"""
+    seed_coupon("product-wise", {"product_id": 99, "discount": 20})
+    resp = client.post("/applicable-coupons", content=SAMPLE_CART_BYTES)
+    assert resp.json()["applicable_coupons"] == []
+
+
+def test_inactive_coupon_excluded(client):
+    """Inactive coupons should not appear in applicable-coupons"""
+    seed_coupon("cart-wise", {"threshold": 100, "discount": 10}, is_active=False)
+    resp = client.post("/applicable-coupons", content=SAMPLE_CART_BYTES)
+    assert resp.json()["applicable_coupons"] == []
+
+
+def test_mixed_types_returned_in_id_order(client):
+    """Coupons are pre-filtered per type but still reported in creation order"""
+    first, _, third = seed_many([
+        {"type": "product-wise", "details": {"product_id": 1, "discount": 20}},
+        {"type": "cart-wise", "details": {"threshold": 500, "discount": 10}},  # not reachable
+        {"type": "cart-wise", "details": {"threshold": 100, "discount": 10}},
+    ])
+    resp = client.post("/applicable-coupons", content=SAMPLE_CART_BYTES)
+    ids = [c["coupon_id"] for c in resp.json()["applicable_coupons"]]
+    assert ids == [first, third]
+
+
+def test_updated_details_reflected(client):
+    """Parsed details are cached per coupon; an update must not serve stale values"""
+    coupon_id = seed_coupon("cart-wise", {"threshold": 100, "discount": 10})
+    client.post("/applicable-coupons", content=SAMPLE_CART_BYTES)
+    client.put(f"/coupons/{coupon_id}", json={"details": {"threshold": 100, "discount": 20}})
+    resp = client.post("/applicable-coupons", content=SAMPLE_CART_BYTES)
+    assert resp.json()["applicable_coupons"][0]["discount"] == 88.0  # 20% of 440
+
+
+def test_deleted_coupon_excluded(client):
+    """The active-coupon index is rebuilt after a delete"""
+    coupon_id = seed_coupon("cart-wise", {"threshold": 100, "discount": 10})
+    client.post("/applicable-coupons", content=SAMPLE_CART_BYTES)
+    client.delete(f"/coupons/{coupon_id}")
+    resp = client.post("/applicable-coupons", content=SAMPLE_CART_BYTES)
+    assert resp.json()["applicable_coupons"] == []
 
 
 # ══════════════════════════════════════════════
 #  Apply Coupon Tests
 # ══════════════════════════════════════════════
 
-class TestApplyCoupon:
-
-    def test_apply_cart_wise_coupon(self):
-        """10% off on 440 = 44 discount, final = 396"""
-        created = create_cart_wise_coupon(threshold=100, discount=10).json()
-        resp = client.post(f"/apply-coupon/{created['id']}", json=SAMPLE_CART)
-        assert resp.status_code == 200
-        cart = resp.json()["updated_cart"]
-        assert cart["total_price"] == 440.0
-        assert cart["total_discount"] == 44.0
-        assert cart["final_price"] == 396.0
-
-    def test_apply_product_wise_coupon(self):
-        """20% off on product 1 (6*50=300) => discount=60, final=440-60=380"""
-        created = create_product_wise_coupon(product_id=1, discount=20).json()
-        resp = client.post(f"/apply-coupon/{created['id']}", json=SAMPLE_CART)
-        assert resp.status_code == 200
-        cart = resp.json()["updated_cart"]
-        assert cart["total_discount"] == 60.0
-        assert cart["final_price"] == 380.0
-        # Only product 1 item should have discount
-        items = cart["items"]
-        p1_item = next(i for i in items if i["product_id"] == 1)
-        assert p1_item["total_discount"] == 60.0
-
-    def test_apply_bxgy_coupon(self):
-        """1 free unit of product 3 (price=25). discount=25"""
-        created = create_bxgy_coupon().json()
-        resp = client.post(f"/apply-coupon/{created['id']}", json=SAMPLE_CART)
-        assert resp.status_code == 200
-        cart = resp.json()["updated_cart"]
-        assert cart["total_discount"] == 25.0
-        # Product 3 quantity should increase by 1
-        p3_item = next(i for i in cart["items"] if i["product_id"] == 3)
-        assert p3_item["quantity"] == 3  # 2 original + 1 free
-
-    def test_apply_coupon_not_found(self):
-        resp = client.post("/apply-coupon/9999", json=SAMPLE_CART)
-        assert resp.status_code == 404
-
-    def test_apply_inactive_coupon(self):
-        created = create_cart_wise_coupon().json()
-        client.put(f"/coupons/{created['id']}", json={"is_active": False})
-        resp = client.post(f"/apply-coupon/{created['id']}", json=SAMPLE_CART)
-        assert resp.status_code == 400
-        assert "not active" in resp.json()["detail"].lower()
-
-    def test_apply_coupon_conditions_not_met(self):
-        """Cart total is 440 but threshold is 500"""
-        created = create_cart_wise_coupon(threshold=500, discount=10).json()
-        resp = client.post(f"/apply-coupon/{created['id']}", json=SAMPLE_CART)
-        assert resp.status_code == 400
-
-    def test_apply_expired_coupon(self):
-        created = client.post("/coupons", json={
-            "type": "cart-wise",
-            "details": {"threshold": 100, "discount": 10},
-            "expiration_date": "2020-01-01T00:00:00"
-        }).json()
-        resp = client.post(f"/apply-coupon/{created['id']}", json=SAMPLE_CART)
-        assert resp.status_code == 400
-        assert "expired" in resp.json()["detail"].lower()
+def test_apply_inactive_coupon(client):
+    coupon_id = seed_coupon("cart-wise", {"threshold": 100, "discount": 10}, is_active=False)
+    resp = client.post(f"/apply-coupon/{coupon_id}", content=SAMPLE_CART_BYTES)
+    assert resp.status_code == 400
+    assert "not active" in resp.json()["detail"].lower()
+
+
+def test_apply_coupon_conditions_not_met(client):
+    """Cart total is 440 but threshold is 500"""
+    coupon_id = seed_coupon("cart-wise", {"threshold": 500, "discount": 10})
+    resp = client.post(f"/apply-coupon/{coupon_id}", content=SAMPLE_CART_BYTES)
+    assert resp.status_code == 400
+
+
+def test_apply_expired_coupon(client):
+    coupon_id = seed_coupon(
+        "cart-wise", {"threshold": 100, "discount": 10}, expiration_date=datetime(2020, 1, 1)
+    )
+    resp = client.post(f"/apply-coupon/{coupon_id}", content=SAMPLE_CART_BYTES)
+    assert resp.status_code == 400
+    assert "expired" in resp.json()["detail"].lower()
+
+
+def test_apply_product_wise_duplicate_lines(client):
+    """
+    Product 1 on two lines at 0.05: each line rounds to 0.01, and the total
+    is the sum of the lines so final_price agrees with the items.
+    """
+    coupon_id = seed_coupon("product-wise", {"product_id": 1, "discount": 10})
+    body = {"cart": {"items": [
+        {"product_id": 1, "quantity": 1, "price": 0.05},
+        {"product_id": 1, "quantity": 1, "price": 0.05},
+    ]}}
+
+    resp = client.post("/applicable-coupons", json=body)
+    assert resp.json()["applicable_coupons"][0]["discount"] == 0.02
+
+    resp = client.post(f"/apply-coupon/{coupon_id}", json=body)
+    assert resp.status_code == 200
+    cart = resp.json()["updated_cart"]
+    assert [i["total_discount"] for i in cart["items"]] == [0.01, 0.01]
+    assert cart["total_discount"] == 0.02
 
 
 # ══════════════════════════════════════════════
 #  BxGy Edge Cases
 # ══════════════════════════════════════════════
 
-class TestBxGyEdgeCases:
-
-    def test_bxgy_repetition_limit_respected(self):
-        """
-        Cart: 6 of P1, threshold=3. With limit=1, only 1 repetition allowed.
-        Discount = 1 * 1 * price_p3 * qty_get = 1 * 25 = 25
-        """
-        created = client.post("/coupons", json={
-            "type": "bxgy",
-            "details": {
-                "buy_products": [{"product_id": 1, "quantity": 3}],
-                "get_products": [{"product_id": 3, "quantity": 1}],
-                "repition_limit": 1
-            }
-        }).json()
-        resp = client.post(f"/apply-coupon/{created['id']}", json=SAMPLE_CART)
-        assert resp.status_code == 200
-        cart = resp.json()["updated_cart"]
-        assert cart["total_discount"] == 25.0
-
-    def test_bxgy_not_enough_buy_products(self):
-        """
-        Buy qty needed = 10, but cart only has 6 of P1. Not applicable.
-        BxGy returns 0 discount — apply-coupon should succeed but with 0 discount.
-        """
-        created = client.post("/coupons", json={
-            "type": "bxgy",
-            "details": {
-                "buy_products": [{"product_id": 1, "quantity": 10}],
-                "get_products": [{"product_id": 3, "quantity": 1}],
-                "repition_limit": 1
-            }
-        }).json()
-        # applicable-coupons should not include this
-        resp = client.post("/applicable-coupons", json=SAMPLE_CART)
-        applicable_ids = [c["coupon_id"] for c in resp.json()["applicable_coupons"]]
-        assert created["id"] not in applicable_ids
-
-    def test_bxgy_get_product_not_in_cart(self):
-        """
-        Free product (P99) is not in the cart at all. It should be added with qty=free_qty.
-        But discount value = 0 since price is unknown.
-        """
-        created = client.post("/coupons", json={
-            "type": "bxgy",
-            "details": {
-                "buy_products": [{"product_id": 1, "quantity": 3}],
-                "get_products": [{"product_id": 99, "quantity": 1}],
-                "repition_limit": 1
-            }
-        }).json()
-        # Check applicable — discount=0 so it won't appear
-        resp = client.post("/applicable-coupons", json=SAMPLE_CART)
-        applicable_ids = [c["coupon_id"] for c in resp.json()["applicable_coupons"]]
-        assert created["id"] not in applicable_ids
+def test_bxgy_repetition_limit_respected(client):
+    """
+    Cart: 6 of P1, threshold=3. With limit=1, only 1 repetition allowed.
+    Discount = 1 * 1 * price_p3 * qty_get = 1 * 25 = 25
+    """
+    coupon_id = seed_coupon("bxgy", {
+        "buy_products": [{"product_id": 1, "quantity": 3}],
+        "get_products": [{"product_id": 3, "quantity": 1}],
+        "repition_limit": 1
+    })
+    resp = client.post(f"/apply-coupon/{coupon_id}", content=SAMPLE_CART_BYTES)
+    assert resp.status_code == 200
+    cart = resp.json()["updated_cart"]
+    assert cart["total_discount"] == 25.0
+
+
+def test_bxgy_multiple_repetitions(client):
+    """
+    Cart: 6 of P1, buy 3 of P1 with limit=2 => 2 repetitions.
+    2 free units of P3 (price=25) => discount=50, P3 quantity 2 + 2 = 4.
+    """
+    coupon_id = seed_coupon("bxgy", {
+        "buy_products": [{"product_id": 1, "quantity": 3}],
+        "get_products": [{"product_id": 3, "quantity": 1}],
+        "repition_limit": 2
+    })
+    resp = client.post(f"/apply-coupon/{coupon_id}", content=SAMPLE_CART_BYTES)
+    assert resp.status_code == 200
+    cart = resp.json()["updated_cart"]
+    assert cart["total_discount"] == 50.0
+    assert _by_pid(cart)[3]["quantity"] == 4
+
+
+def test_bxgy_duplicate_buy_product_counted_once(client):
+    """
+    P1 listed twice (3 + 3) merges into buy 6 of P1. The cart's 6 units of P1
+    are counted once, so only 1 repetition is earned despite limit=2.
+    """
+    coupon_id = seed_coupon("bxgy", {
+        "buy_products": [{"product_id": 1, "quantity": 3}, {"product_id": 1, "quantity": 3}],
+        "get_products": [{"product_id": 3, "quantity": 1}],
+        "repition_limit": 2
+    })
+    resp = client.post(f"/apply-coupon/{coupon_id}", content=SAMPLE_CART_BYTES)
+    assert resp.status_code == 200
+    cart = resp.json()["updated_cart"]
+    assert cart["total_discount"] == 25.0
+    assert _by_pid(cart)[3]["quantity"] == 3
+
+
+def test_bxgy_not_enough_buy_products(client):
+    """
+    Buy qty needed = 10, but cart only has 6 of P1. Not applicable.
+    BxGy returns 0 discount — apply-coupon should succeed but with 0 discount.
+    """
+    coupon_id = seed_coupon("bxgy", {
+        "buy_products": [{"product_id": 1, "quantity": 10}],
+        "get_products": [{"product_id": 3, "quantity": 1}],
+        "repition_limit": 1
+    })
+    # applicable-coupons should not include this
+    resp = client.post("/applicable-coupons", content=SAMPLE_CART_BYTES)
+    applicable_ids = [c["coupon_id"] for c in resp.json()["applicable_coupons"]]
+    assert coupon_id not in applicable_ids
+
+
+def test_bxgy_get_product_not_in_cart(client):
+    """
+    Free product (P99) is not in the cart at all. It should be added with qty=free_qty.
+    But discount value = 0 since price is unknown.
+    """
+    coupon_id = seed_coupon("bxgy", {
+        "buy_products": [{"product_id": 1, "quantity": 3}],
+        "get_products": [{"product_id": 99, "quantity": 1}],
+        "repition_limit": 1
+    })
+    # Check applicable — discount=0 so it won't appear
+    resp = client.post("/applicable-coupons", content=SAMPLE_CART_BYTES)
+    applicable_ids = [c["coupon_id"] for c in resp.json()["applicable_coupons"]]
+    assert coupon_id not in applicable_ids
+
+
+def test_bxgy_missing_get_product_appended(client):
+    """A free product missing from the cart is appended after the original items"""
+    coupon_id = seed_coupon("bxgy", {
+        "buy_products": [{"product_id": 1, "quantity": 3}],
+        "get_products": [{"product_id": 99, "quantity": 1}, {"product_id": 3, "quantity": 1}],
+        "repition_limit": 1
+    })
+    resp = client.post(f"/apply-coupon/{coupon_id}", content=SAMPLE_CART_BYTES)
+    assert resp.status_code == 200
+    items = resp.json()["updated_cart"]["items"]
+    assert [i["product_id"] for i in items] == [1, 2, 3, 99]
+    assert items[-1]["quantity"] == 1
+    assert items[-1]["total_discount"] == 0.0